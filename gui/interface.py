@@ -1,21 +1,33 @@
 import tkinter as tk
 from tkinter import messagebox
 from tkinter.ttk import Progressbar
+import queue
 import threading
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Ensure src can be imported even when running from subfolders
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from src.main import process_all_images
+from src.main import process_all_images, shutdown_executor
+
+# How often the Tk main loop drains progress events (ms)
+PROGRESS_POLL_MS = 50
 
 
 class ImageBuilderGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Photoshop Image Builder Automation")
-        self.root.geometry("650x200")
+        self.root.geometry("650x240")
+        self._last_progress = -1
+        self._progress_queue = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._running = False
+        self._future = None
+        # One long-lived worker thread, reused for every run
+        self._executor = ThreadPoolExecutor(max_workers=1)
         self.create_widgets()
 
         # Static paths for development
@@ -30,36 +42,77 @@ class ImageBuilderGUI:
         tk.Button(self.root, text="Start Processing", command=self.start_processing).pack(pady=10)
         self.progress = Progressbar(self.root, orient="horizontal", length=400, mode="determinate")
         self.progress.pack(pady=10)
+        tk.Button(self.root, text="Cancel", command=self.cancel_processing).pack(pady=5)
 
     def start_processing(self):
+        if self._running:
+            return
         if not all([self.excel_path, self.logo_path, self.image_path]):
             messagebox.showerror("Missing Input", "One or more static paths are missing.")
             return
 
         self.progress["value"] = 0
-        threading.Thread(target=self.run_process).start()
+        self._last_progress = -1
+        self._cancel_event.clear()
+        self._running = True
+        self._future = self._executor.submit(self.run_process)
+        self.root.after(PROGRESS_POLL_MS, self._drain_progress)
+
+    def cancel_processing(self):
+        # Rows already being placed finish; everything still queued is dropped
+        self._cancel_event.set()
 
     def run_process(self):
-        try:
-            process_all_images(
-                excel_file=self.excel_path,
-                image_folder=self.image_path,
-                logo_folder=self.logo_path,
-                progress_callback=self.update_progress
-            )
+        process_all_images(
+            excel_file=self.excel_path,
+            image_folder=self.image_path,
+            logo_folder=self.logo_path,
+            progress_callback=self.update_progress,
+            cancel_event=self._cancel_event
+        )
+
+    def _show_result(self, future):
+        error = future.exception()
+        if error is not None:
+            messagebox.showerror("Error", str(error))
+        elif self._cancel_event.is_set():
+            messagebox.showinfo("Cancelled", "Processing was cancelled.")
+        else:
             messagebox.showinfo("Done", "All images processed successfully!")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
 
     def update_progress(self, value):
-        self.progress["value"] = value
-        self.root.update_idletasks()
+        # Called from the worker thread: only queue whole-percent changes for the main loop
+        value = int(value)
+        if value == self._last_progress:
+            return
+        self._last_progress = value
+        self._progress_queue.put(value)
+
+    def _drain_progress(self):
+        # Runs on the Tk main loop and also picks up the end of a run; done() is read
+        # before draining so a finished run's last progress value is shown
+        finished = self._future.done()
+        value = None
+        while True:
+            try:
+                value = self._progress_queue.get_nowait()
+            except queue.Empty:
+                break
+        if value is not None:
+            self.progress["value"] = value
+        if finished:
+            self._running = False
+            self._show_result(self._future)
+        else:
+            self.root.after(PROGRESS_POLL_MS, self._drain_progress)
 
 
 if __name__ == '__main__':
     root = tk.Tk()
     app = ImageBuilderGUI(root)
     root.mainloop()
+    # Placement workers are kept alive between runs; stop them with the window
+    shutdown_executor()
 
 
 # import tkinter as tk
@@ -1,4 +1,7 @@
-import pandas as pd
+import os
+from collections import OrderedDict
+
+import openpyxl
 
 REQUIRED_COLUMNS = [
     "Supplier Part ID",
@@ -11,61 +14,101 @@ REQUIRED_COLUMNS = [
     "Supplier Name"  # NEW column
 ]
 
-def parse_excel_file(excel_path):
+# Rows missing any of these values are skipped
+CRITICAL_COLUMNS = [
+    "Supplier Part ID", "Decoration Code",
+    "Final Image Name", "Location As per Word file",
+    "Supplier Name"  # ensure Supplier Name is not null
+]
+
+# (abs path, mtime_ns, size) -> value tuples (REQUIRED_COLUMNS order) parsed
+# from that exact version of the file
+_rows_cache = OrderedDict()
+ROWS_CACHE_SIZE = 8
+
+def cell_text(value):
+    # Stray spaces around IDs/codes/names would break file and location lookups
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, float) and value.is_integer():
+        # calamine hands back whole numbers as floats; keep IDs like 12345, not 12345.0
+        return str(int(value))
+    return str(value)
+
+def is_blank(value):
+    # Same as cell_text(value) == ""
+    return value is None or (isinstance(value, str) and (value == "" or value.isspace()))
+
+def iter_excel_rows(excel_path):
+    # An unchanged workbook is served from _rows_cache
+    st = os.stat(excel_path)
+    cache_key = (os.path.abspath(excel_path), st.st_mtime_ns, st.st_size)
+    cached = _rows_cache.get(cache_key)
+    if cached is not None:
+        _rows_cache.move_to_end(cache_key)
+        for values in cached:
+            yield dict(zip(REQUIRED_COLUMNS, values))
+        return
+
+    rows = []
+    for values in stream_excel_rows(excel_path):
+        rows.append(values)
+        # Callers get their own dict per row (main.py copies/edits them for FRONT_ jobs)
+        yield dict(zip(REQUIRED_COLUMNS, values))
+
+    # Only cache a complete read
+    _rows_cache[cache_key] = rows
+    if len(_rows_cache) > ROWS_CACHE_SIZE:
+        _rows_cache.popitem(last=False)
+
+def iter_sheet_values(excel_path):
+    """
+    Yields the first sheet's rows as value tuples, header first. Uses
+    python-calamine (Rust) when it is installed, otherwise openpyxl in
+    read-only mode.
+    """
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        CalamineWorkbook = None
+
+    if CalamineWorkbook is not None:
+        wb = CalamineWorkbook.from_path(excel_path)
+        try:
+            for values in wb.get_sheet_by_index(0).iter_rows():
+                yield tuple(values)
+        finally:
+            wb.close()
+        return
+
+    # Read-only mode streams the sheet row by row
+    wb = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def stream_excel_rows(excel_path):
+    # Yields one tuple of cell texts per usable row, in REQUIRED_COLUMNS order
+    rows = iter_sheet_values(excel_path)
     try:
-        df = pd.read_excel(excel_path)
+        header = next(rows, ())
 
         # Validate required columns
-        missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+        missing_cols = [col for col in REQUIRED_COLUMNS if col not in header]
         if missing_cols:
             raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
 
-        df = df[REQUIRED_COLUMNS]
-
-        # Drop rows with any crucial missing values
-        df.dropna(subset=[
-            "Supplier Part ID", "Decoration Code",
-            "Final Image Name", "Location As per Word file",
-            "Supplier Name"  # ensure Supplier Name is not null
-        ], inplace=True)
-
-        # return df.to_dict(orient="records")
-        return df.to_dict(orient="records")
-
-    except Exception as e:
-        raise RuntimeError(f"Error reading Excel file: {str(e)}")
-
-
-
-# # excel_parser.py
-
-# import os
-# import pandas as pd
-
-# REQUIRED_COLUMNS = [
-#     "Supplier Part ID", "Supplier Color", "Decoration Code",
-#     "Decoration Color", "Decoration Location", "Final Image Name",
-#     "Location As per Word file"
-# ]
-
-# class ExcelParser:
-#     def __init__(self, excel_path):
-#         self.excel_path = excel_path
-
-#     def read_excel(self):
-#         if not os.path.exists(self.excel_path):
-#             raise FileNotFoundError(f"Excel file not found: {self.excel_path}")
-
-#         try:
-#             df = pd.read_excel(self.excel_path)
-#         except Exception as e:
-#             raise Exception(f"Failed to read Excel file: {e}")
-
-#         for col in REQUIRED_COLUMNS:
-#             if col not in df.columns:
-#                 raise ValueError(f"Missing required column: {col}")
-
-#         df = df[REQUIRED_COLUMNS]
-#         df.dropna(subset=["Supplier Part ID", "Decoration Code"], inplace=True)
-
-#         return df.to_dict(orient="records")
+        indexes = [header.index(col) for col in REQUIRED_COLUMNS]
+        critical_indexes = [header.index(col) for col in CRITICAL_COLUMNS]
+        for values in rows:
+            # Skip rows with any crucial missing values
+            if any(i >= len(values) or is_blank(values[i]) for i in critical_indexes):
+                continue
+
+            # Every field is used as text (IDs, codes, file names); empty cells become ""
+            yield tuple(cell_text(values[i]) if i < len(values) else "" for i in indexes)
+    finally:
+        rows.close()
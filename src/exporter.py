@@ -1,155 +1,277 @@
 # exporter.py
 
+import json
+import logging
 import os
 import subprocess
-import platform
+import sys
 import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import ensure_dir
+
+logger = logging.getLogger(__name__)
+
+_IS_WINDOWS = os.name == "nt"
+_IS_LINUX = sys.platform.startswith("linux")
+
+# Bridge script next to this module, with forward slashes for JSX
+BRIDGE_SCRIPT_JSX = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "photoshop_bridge.jsx"
+).replace("\\", "/")
+
+# Buffer for the plain-copy fallback in _fast_clone
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+# Linux FICLONE ioctl (_IOW(0x94, 9, int)): copy-on-write clone on btrfs/xfs
+FICLONE = 0x40049409
+
+# -r scripts are kept here until the next PhotoshopSession: a running Photoshop
+# takes the request and the launcher exits before the script has been read
+JSX_SCRIPT_FOLDER = os.path.join(tempfile.gettempdir(), "photoshop_automation_jsx")
+
+# Threads for the per-image file work after a Photoshop batch
+_copy_pool = None
+_copy_pool_lock = threading.Lock()
+
+# COM objects belong to the thread that created them, so the handle is per thread
+_photoshop = threading.local()
+
+def get_photoshop_app():
+    app = getattr(_photoshop, "app", None)
+    if app is None:
+        import pythoncom
+        import win32com.client
+        pythoncom.CoInitialize()
+        app = win32com.client.Dispatch("Photoshop.Application")
+        _photoshop.app = app
+    return app
+
+def close_photoshop_app():
+    # Releases this thread's handle; Photoshop itself is left running for the user
+    if getattr(_photoshop, "app", None) is not None:
+        import pythoncom
+        _photoshop.app = None
+        pythoncom.CoUninitialize()
+
+def run_photoshop_script(runtime_code, photoshop_path=None):
+    try:
+        app = get_photoshop_app()
+    except ImportError:
+        # pywin32 not installed: launch Photoshop with the script instead
+        photoshop_exe = photoshop_path or shutil.which("Photoshop") or "Photoshop"
+        # A batch's script can pass the 8191-char command-line limit, so it goes in a file
+        ensure_dir(JSX_SCRIPT_FOLDER)
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".jsx", dir=JSX_SCRIPT_FOLDER, delete=False, encoding="utf-8"
+        ) as f:
+            f.write(runtime_code)
+            script_path = f.name
+        logger.debug("[Photoshop JSX] Running: %s -r %s", photoshop_exe, script_path)
+        subprocess.run([photoshop_exe, "-r", script_path], check=True)
+        return
+
+    logger.debug("[Photoshop JSX] Running: %s", runtime_code)
+    return app.DoJavaScript(runtime_code)
+
+class PhotoshopSession:
+    """
+    One Photoshop connection for a whole run: the COM handle is created on the
+    first export and reused for every batch, then released on exit.
+    """
+    def __enter__(self):
+        remove_old_scripts()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        close_photoshop_app()
+        return False
+
+    def export(self, exports, settings):
+        return export_final_images(exports, settings)
+
+def remove_old_scripts():
+    # Scripts an earlier run handed to Photoshop with -r
+    try:
+        names = os.listdir(JSX_SCRIPT_FOLDER)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.remove(os.path.join(JSX_SCRIPT_FOLDER, name))
+        except OSError:
+            pass  # still open in Photoshop; removed by a later run
+
+def _fast_clone(src, dst):
+    # Cheapest independent copy the filesystem offers: reflink, kernel copy, then plain copy.
+    # No hardlinks: src is rewritten in place by the next run and dst must not follow it.
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if _IS_WINDOWS:
+        import ctypes
+        if ctypes.windll.kernel32.CopyFileW(src, dst, False):
+            return
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if _IS_LINUX:
+            try:
+                import fcntl
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass  # not a reflink-capable filesystem
+
+        for copy_chunk in _KERNEL_COPIES:
+            try:
+                _kernel_copy(copy_chunk, fsrc, fdst)
+                return
+            except OSError:
+                _rewind(fsrc, fdst)
+        shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+
+def _make_thumbnail(src, dst, size):
+    from PIL import Image
+
+    size = tuple(size)
+    with Image.open(src) as img:
+        # JPEG only: libjpeg decodes straight at a reduced scale
+        img.draft("RGB", size)
+        img.thumbnail(size, Image.LANCZOS)
+        if img.mode not in ("RGB", "L") and os.path.splitext(dst)[1].lower() in (".jpg", ".jpeg"):
+            img = img.convert("RGB")
+        img.save(dst, quality=85)
+
+def _kernel_copy(copy_chunk, fsrc, fdst):
+    # copy_chunk(in_fd, out_fd, offset) copies from offset and returns the bytes sent
+    in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+    offset = 0
+    while True:
+        sent = copy_chunk(in_fd, out_fd, offset)
+        if sent == 0:
+            break
+        offset += sent
+
+def _rewind(fsrc, fdst):
+    fsrc.seek(0)
+    fdst.seek(0)
+    fdst.truncate()
+
+def _copy_file_range_chunk(in_fd, out_fd, offset):
+    return os.copy_file_range(in_fd, out_fd, 1 << 30, offset, offset)
+
+def _sendfile_chunk(in_fd, out_fd, offset):
+    return os.sendfile(out_fd, in_fd, offset, 1 << 30)
+
+# Kernel copies this platform has, in the order _fast_clone tries them
+_KERNEL_COPIES = [
+    chunk for name, chunk in (("copy_file_range", _copy_file_range_chunk), ("sendfile", _sendfile_chunk))
+    if hasattr(os, name)
+]
 
 def export_final_image(intermediate_image_path, job, settings):
+    failures = export_final_images([(intermediate_image_path, job)], settings)
+    if failures:
+        raise failures[0][1]
+
+def export_final_images(exports, settings):
+    # exports: list of (intermediate_image_path, job), run as one Photoshop script.
+    # Returns [(job, error)] for the jobs whose script failed or output didn't appear.
     try:
-        print("intermediate_image_path>>>>>>>>>>",intermediate_image_path)
-        final_output_path = os.path.join(settings["output_folder"], job["Final Image Name"])
-        jsx_script_path = os.path.abspath(os.path.join("src", "photoshop_bridge.jsx"))
-        print("final_output_path>>>>>>>>>>>>>>",final_output_path)
-        # Convert paths to forward slashes for JSX
-        input_image_jsx = intermediate_image_path.replace("\\", "/")
-        output_image_jsx = final_output_path.replace("\\", "/")
-        jsx_script_jsx = jsx_script_path.replace("\\", "/")
-
-        # Prepare Photoshop script arguments
-        args = [
-            "Photoshop",
-            f'-r "var inputImagePath = \'{input_image_jsx}\';',
-            f'var outputImagePath = \'{output_image_jsx}\';',
-            f'$.evalFile(\'{jsx_script_jsx}\');"'
-        ]
-
-        # Construct full command
-        command = " ".join(args)
-        print(f"[Photoshop JSX] Running: {command}")
-
-        if platform.system() == "Windows":
-            subprocess.run(["cmd", "/c", command], check=True)
+        jsx_script_jsx = BRIDGE_SCRIPT_JSX
+
+        final_output_paths = []
+        runtime_code = []
+        script_errors = {}
+        for intermediate_image_path, job in exports:
+            final_output_path = os.path.join(settings["output_folder"], job["Final Image Name"])
+            logger.debug("Exporting %s -> %s", intermediate_image_path, final_output_path)
+            final_output_paths.append(final_output_path)
+
+            # Forward-slash paths as JS string literals
+            input_image_jsx = json.dumps(intermediate_image_path.replace("\\", "/"))
+            output_image_jsx = json.dumps(final_output_path.replace("\\", "/"))
+
+            # Bridge inputs and the bridge script; an error only fails this image
+            runtime_code.append(
+                f"try {{ var inputImagePath = {input_image_jsx};"
+                f" var outputImagePath = {output_image_jsx};"
+                f" $.evalFile({json.dumps(jsx_script_jsx)}); }}"
+                f" catch (e) {{ exportErrors.push({len(final_output_paths) - 1} + '\\t'"
+                f" + String(e).replace(/[\\r\\n]+/g, ' ')); }}"
+            )
+
+        if not settings.get("export_via_photoshop", True):
+            # The placed image is the final image
+            pass
+        elif _IS_WINDOWS:
+            # The script's value is "index<TAB>error" per failed image
+            result = run_photoshop_script(
+                " ".join(["var exportErrors = [];"] + runtime_code + ["exportErrors.join('\\n');"]),
+                settings.get("photoshop_path")
+            )
+            if result is None:
+                # Launched with -r: the script's value never comes back, and the existence
+                # check in _finish_export can't tell a failed image apart, so it goes unreported
+                logger.warning("Photoshop ran without COM; per-image export errors are unknown")
+            for line in (result or "").splitlines():
+                index, _, message = line.partition("\t")
+                try:
+                    script_errors[int(index)] = message
+                except ValueError:
+                    # Not one of ours (e.g. text printed by the bridge script)
+                    logger.debug("Unexpected Photoshop output: %s", line)
         else:
             raise EnvironmentError("This script currently supports only Windows + Photoshop scripting.")
 
+    except Exception as e:
+        logger.debug("Export error: %s", e)
+        raise
+
+    results = _get_copy_pool().map(
+        _finish_export,
+        [intermediate_image_path for intermediate_image_path, _ in exports],
+        [job for _, job in exports],
+        final_output_paths,
+        [script_errors.get(i) for i in range(len(exports))],
+        [settings] * len(exports)
+    )
+    return [(job, e) for (_, job), e in zip(exports, results) if e is not None]
+
+def _get_copy_pool():
+    global _copy_pool
+    with _copy_pool_lock:
+        if _copy_pool is None:
+            _copy_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+        return _copy_pool
+
+def _finish_export(intermediate_image_path, job, final_output_path, script_error, settings):
+    # Puts the final image and its thumbnail in place; returns the error instead of raising
+    try:
+        if not settings.get("export_via_photoshop", True) and \
+                os.path.abspath(intermediate_image_path) != os.path.abspath(final_output_path):
+            if settings.get("move_intermediate", False):
+                os.replace(intermediate_image_path, final_output_path)
+            else:
+                _fast_clone(intermediate_image_path, final_output_path)
+
         # Copy to thumbnails
+        if script_error:
+            raise RuntimeError(f"Export failed for {final_output_path}: {script_error}")
         if os.path.exists(final_output_path):
             thumbnail_path = os.path.join(settings["thumbnail_folder"], job["Final Image Name"])
-            shutil.copy(final_output_path, thumbnail_path)
-            print(f"Exported & Copied Thumbnail: {thumbnail_path}")
+            ensure_dir(os.path.dirname(thumbnail_path))
+            thumbnail_size = settings.get("thumbnail_size")
+            if thumbnail_size:
+                _make_thumbnail(final_output_path, thumbnail_path, thumbnail_size)
+            else:
+                _fast_clone(final_output_path, thumbnail_path)
+            logger.debug("Exported & Copied Thumbnail: %s", thumbnail_path)
         else:
             raise FileNotFoundError(f"Export failed: {final_output_path} not found")
-
     except Exception as e:
-        print(f"Export error: {e}")
-        raise
-
-# # exporter.py
-
-# import os
-# import subprocess
-# import platform
-# import shutil
-
-# def export_final_image(intermediate_image_path, job, settings):
-#     try:
-#         print("intermediate_image_path>>>>>>>>>>",intermediate_image_path)
-#         final_output_path = os.path.join(settings["output_folder"], job["Final Image Name"])
-#         jsx_script_path = os.path.abspath(os.path.join("src", "photoshop_bridge.jsx"))
-#         print("final_output_path>>>>>>>>>>>>>>",final_output_path)
-#         # Convert paths to forward slashes for JSX
-#         input_image_jsx = intermediate_image_path.replace("\\", "/")
-#         output_image_jsx = final_output_path.replace("\\", "/")
-#         jsx_script_jsx = jsx_script_path.replace("\\", "/")
-
-#         # Prepare Photoshop script arguments
-#         args = [
-#             "Photoshop",
-#             f'-r "var inputImagePath = \'{input_image_jsx}\';',
-#             f'var outputImagePath = \'{output_image_jsx}\';',
-#             f'$.evalFile(\'{jsx_script_jsx}\');"'
-#         ]
-
-#         # Construct full command
-#         command = " ".join(args)
-#         print(f"[Photoshop JSX] Running: {command}")
-
-#         if platform.system() == "Windows":
-#             subprocess.run(["cmd", "/c", command], check=True)
-#         else:
-#             raise EnvironmentError("This script currently supports only Windows + Photoshop scripting.")
-
-#         # Copy to thumbnails
-#         if os.path.exists(final_output_path):
-#             thumbnail_path = os.path.join(settings["thumbnail_folder"], job["Final Image Name"])
-#             shutil.copy(final_output_path, thumbnail_path)
-#             print(f"Exported & Copied Thumbnail: {thumbnail_path}")
-#         else:
-#             raise FileNotFoundError(f"Export failed: {final_output_path} not found")
-
-#     except Exception as e:
-#         print(f"Export error: {e}")
-#         raise
-
-
-
-# # exporter.py
-# import os
-# import subprocess
-# from PIL import Image
-
-
-# def export_final_image(intermediate_image_path, job, settings):
-#     """
-#     Triggers Photoshop JSX script to create PSD + JPG and generates a thumbnail.
-#     """
-#     final_name = job["Final Image Name"]
-#     output_folder = settings["output_folder"]
-#     thumbnail_folder = settings["thumbnail_folder"]
-#     jsx_script_path = os.path.abspath("src/photoshop_bridge.jsx")
-
-#     logo_position = job.get("logo_position", (100, 100))  # fallback
-#     x, y = int(logo_position[0]), int(logo_position[1])
-
-#     # Define export paths
-#     input_image = os.path.abspath(intermediate_image_path)
-#     logo_image = os.path.abspath(job["logo_path"])  # you need to set this in job object
-#     output_psd_path = os.path.join(output_folder, final_name.replace(".jpg", ".psd"))
-#     output_jpg_path = os.path.join(output_folder, final_name)
-
-#     # Prepare the Photoshop command
-#     ps_script = f"""
-# var inputImage = "{input_image.replace("\\\\", "/")}";
-# var logoImage = "{logo_image.replace("\\\\", "/")}";
-# var x = {x};
-# var y = {y};
-# var outputPsd = "{output_psd_path.replace("\\\\", "/")}";
-# var outputJpg = "{output_jpg_path.replace("\\\\", "/")}";
-# $.evalFile("{jsx_script_path.replace("\\\\", "/")}");
-# placeLogoAndExport(inputImage, logoImage, x, y, outputPsd, outputJpg);
-# """
-
-#     try:
-#         temp_script_file = "temp_script.jsx"
-#         with open(temp_script_file, "w") as f:
-#             f.write(ps_script)
-
-#         # Run Photoshop (assumes it's in PATH or hardcoded here)
-#         subprocess.run(["photoshop", "-r", temp_script_file], check=True)
-
-#         # Clean up
-#         os.remove(temp_script_file)
-
-#         # Generate thumbnail
-#         if not os.path.exists(thumbnail_folder):
-#             os.makedirs(thumbnail_folder)
-
-#         thumbnail_path = os.path.join(thumbnail_folder, final_name)
-#         with Image.open(output_jpg_path) as img:
-#             img.thumbnail((300, 300))
-#             img.save(thumbnail_path)
-
-#         print(f"[✓] Exported PSD & JPG for: {final_name}")
-#     except Exception as e:
-#         print(f"[✗] Error exporting image: {final_name} | Error: {e}")
+        # Logged as a failed job by the caller
+        logger.debug("Export error: %s", e)
+        return e
+    return None
@@ -1,110 +1,353 @@
 # logo_positioner.py
+import bisect
+import functools
+import hashlib
+import logging
+import mmap
 import os
-import tempfile
-import traceback
+from collections import OrderedDict
+from types import MappingProxyType
+import threading
 
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
 from PIL import Image
 import mediapipe as mp
 
+from src.utils import ensure_dir
+
+logger = logging.getLogger(__name__)
+
+
+# Decoded logos kept per positioner
+LOGO_CACHE_SIZE = 32
+# Pose results kept per positioner, keyed by product image
+KEYPOINT_CACHE_SIZE = 256
+
+# pdftoppm output format: raw PPM, lossless around the logo edges
+PDF_RENDER_FORMAT = "ppm"
+# PDF logos are rendered at this multiple of the placement width
+PDF_RENDER_OVERSAMPLE = 2
+
+# Product photos picked up from client folders
+PRODUCT_IMAGE_EXTENSIONS = frozenset((".jpg", ".jpeg", ".png"))
+# Logo file types, in lookup priority order
+LOGO_EXTENSIONS = (".png", ".jpg", ".jpeg", ".pdf")
+
+# Intermediates are re-saved by Photoshop, so PNG favours encode speed over size;
+# JPEG keeps OpenCV's default quality
+INTERMEDIATE_WRITE_PARAMS = {
+    ".png": [cv2.IMWRITE_PNG_COMPRESSION, 1],
+}
+
+
+# ---------------------------
+# MediaPipe Pose shared by every LogoPositioner in the process
+# ---------------------------
+# Placement only reads 2D landmarks of independent still images: Lite graph,
+# no segmentation, no temporal smoothing
+POSE_OPTIONS = {
+    "static_image_mode": True,
+    "model_complexity": 0,
+    "smooth_landmarks": False,
+    "enable_segmentation": False,
+    "min_detection_confidence": 0.5,
+}
+
+# Rows per blend tile in merge_logo_on_image, sized so the scratch arrays stay in cache
+BLEND_TILE_ROWS = 128
+
+# Longest side product photos are shrunk to before Pose (landmarks are normalized 0..1)
+POSE_MAX_SIDE = 512
+
+# A Pose graph is not safe to call from two threads at once: one per thread
+_pose_local = threading.local()
+
+
+def get_pose():
+    pose = getattr(_pose_local, "pose", None)
+    if pose is None:
+        pose = mp.solutions.pose.Pose(**POSE_OPTIONS)
+        _pose_local.pose = pose
+    return pose
+
+
+# ---------------------------
+# Buffered image reads shared by every stage
+# ---------------------------
+# Windows keeps a mapped file locked while the cache below holds it, so files are
+# only mapped on POSIX
+MMAP_IMAGE_READS = os.name != "nt"
+
+
+@functools.lru_cache(maxsize=8)
+def _read_file_bytes(path, mtime_ns):
+    # mtime in the key drops stale entries when a file changes
+    with open(path, "rb", buffering=0) as f:
+        if MMAP_IMAGE_READS:
+            try:
+                # imdecode reads straight out of the page cache
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass  # empty file, or a filesystem that can't be mapped
+        return f.read()
+
+
+def prefetch_file(path):
+    # Starts reading path into the page cache in the background (POSIX only)
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_image(path, flags=cv2.IMREAD_COLOR):
+    """
+    Drop-in for cv2.imread that decodes from the cached file bytes, so the
+    detection and compositing stages don't each go back to disk.
+    Returns None when the file is missing or can't be decoded.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    buf = _read_file_bytes(path, mtime_ns)
+    if not buf:
+        return None
+    return cv2.imdecode(np.frombuffer(buf, np.uint8), flags)
+
+
+# ---------------------------
+# Rasterized PDF logos persisted between runs
+# ---------------------------
+def pdf_logo_cache_path(logo_path, target_width, cache_folder):
+    # Keyed by the PDF's content and render size. Entries are never evicted: the
+    # folder grows by one PNG per logo version and can be deleted at any time.
+    digest = hashlib.sha1()
+    with open(logo_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(f"|{target_width}|{PDF_RENDER_OVERSAMPLE}".encode())
+    stem = os.path.splitext(os.path.basename(logo_path))[0]
+    return os.path.join(cache_folder, f"{stem}-{digest.hexdigest()[:16]}.png")
+
+
+def store_pdf_logo_cache(cache_path, logo_img):
+    # Renamed into place so parallel workers never see a half-written PNG
+    ok, buf = cv2.imencode(".png", logo_img, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        return
+    ensure_dir(os.path.dirname(cache_path))
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buf)
+    os.replace(tmp_path, cache_path)
+
+
+# ---------------------------
+# Product image folder walk
+# ---------------------------
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _walk_product_images(folder, files, by_stem, dir_mtimes):
+    # Same order as os.walk (a folder's files, then its subfolders). The mtime is
+    # taken before listing so a file added mid-walk still invalidates the index.
+    mtime = _dir_mtime(folder)
+    dir_mtimes.append((folder, mtime))
+    if mtime is None:
+        return
+    subdirs = []
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir():
+                    # Like os.walk: symlinked folders are not followed
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in PRODUCT_IMAGE_EXTENSIONS:
+                    files.append((entry.name, entry.path))
+                    by_stem.setdefault(stem, entry.path)
+    except OSError:
+        return
+    for subdir in subdirs:
+        _walk_product_images(subdir, files, by_stem, dir_mtimes)
+
+
+# ---------------------------
+# Location key -> pose landmark index
+# ---------------------------
+# Keys are upper-case: lookups upper-case the requested key. Read-only, shared by every call.
+LOCATION_MAP = MappingProxyType({
+    # (kept the same mapping you had — keys map to indexes)
+    "FULL-BACK": 1,
+    "FULL-FRONT": 2,
+    "LEFT-BICEP": 3,
+    "RIGHT-BICEP": 4,
+    "LEFT-CHEST": 5,
+    "RIGHT-CHEST": 6,
+    "LEFT-COLLAR": 7,
+    "RIGHT-COLLAR": 8,
+    "LEFT-CUFF": 9,
+    "RIGHT-CUFF": 10,
+    "LEFT-HIP": 11,
+    "RIGHT-HIP": 12,
+    "LEFT-SLEEVE": 13,
+    "RIGHT-SLEEVE": 14,
+    "LEFT-THIGH-HIGH": 15,
+    "RIGHT THIGH-HIGH": 16,
+    "ON-POCKET": 17,
+
+    "BACK-YOKE": 18,
+    "FULL-BACK & FULL-FRONT": 19,
+    "LEFT-BICEP-RIGHT-BICEP": 20,
+    "LEFT-CHEST-LEFT-BICEP-RIGHT-BICEP": 21,
+    "LEFT-CHEST-RIGHT-BICEP": 22,
+    "LEFT-CHEST-RIGHT-SLEEVE": 23,
+    "LEFT-SLEEVE-RIGHT-SLEEVE": 24,
+    "RIGHT-CHEST-LEFT-BICEP": 25,
+    "RIGHT-CHEST-LEFT-SLEEVE": 26,
+    "RIGHT-CHEST-LFT-BICEP-RIGHT-BICEP": 27,
+    "FULL-FRONT-FULL-BACK": 28,
+    "LEFT-CHEST-FULL-BACK": 29,
+    "RIGHT-CHEST-FULL-BACK": 30,
+
+    "FRONT-CROWN": 31,
+    "CAP-BACK": 32,
+    "CAP-SIDE": 33,
+    "CAP-FRONT-SIDE": 34,
+    "LOWER-LEFT-CROWN": 35,
+    "LOWER-RIGHT-CROWN": 36,
+    "CORNER-ANGLED-TOWEL": 37,
+    "FRONT_CENTER": 38,
+    "FRONT (ON BAG)": 39,
+    "ON POCKET (ON BAG)": 40
+})
+
+# Pose only returns landmarks 0..32; locations mapped past that can never be placed
+NUM_POSE_LANDMARKS = 33
+
 
 class LogoPositioner:
+    """
+    Places logos on product photos. One positioner per worker process, driven by
+    one thread at a time: its caches, scratch buffers and write queue are not locked.
+    """
     def __init__(self, template_dir):
         self.template_dir = template_dir
-        self.pose = mp.solutions.pose.Pose(static_image_mode=True)
+        # Load the model at worker start-up
+        get_pose()
+        # (logo_folder, decoration code) -> (logo path, mtime_ns, loaded logo image), LRU order
+        self._logo_cache = OrderedDict()
+        # (id(logo image), target width) -> (logo image, resized logo), LRU order
+        self._resized_logo_cache = OrderedDict()
+        # name -> flat uint16 scratch array reused by every blend, see _blend_buffer
+        self._blend_scratch = {}
+        # image shape -> RGB array reused as the Pose input, see _detect_on_bgr
+        self._rgb_scratch = {}
+        # (product image path, mtime_ns) -> keypoints (or None), LRU order
+        self._keypoint_cache = OrderedDict()
+        # client folder -> (walked folder mtimes, product image index), see index_image_folder
+        self._image_index = {}
+        # logo folder -> (folder mtime, {normcased file name: full path}), see index_logo_folder
+        self._logo_index = {}
+        # (output path, writer thread, result dict) per async_write output not yet flushed
+        self._pending_writes = []
+
+    @property
+    def pose(self):
+        # The graph itself lives in get_pose's per-thread storage
+        return get_pose()
 
     # ---------------------------
     # Human keypoint detection
     # ---------------------------
-    def detect_human_keypoints(self, image_path):
+    def detect_human_keypoints(self, image_path, img=None):
+        # Pass img when the caller already decoded the file, to skip a second decode
         try:
-            img = cv2.imread(image_path)
+            if img is None:
+                img = read_image(image_path)
             if img is None:
                 raise Exception("Image not found or unreadable: " + str(image_path))
-
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            results = self.pose.process(img_rgb)
-
-            if not results.pose_landmarks:
-                return None
-
-            keypoints = {}
-            h, w = img.shape[:2]
-            for i, lm in enumerate(results.pose_landmarks.landmark):
-                keypoints[i] = (int(lm.x * w), int(lm.y * h))
-            return keypoints
+            return self._detect_on_bgr(img)
         except Exception as e:
-            print(f"[Keypoint Error] {e}")
-            traceback.print_exc()
+            logger.exception("[Keypoint Error] %s", e)
+            return None
+
+    def _detect_on_bgr(self, img):
+        h, w = img.shape[:2]
+        scale = POSE_MAX_SIDE / float(max(h, w))
+        small = img
+        if scale < 1.0:
+            small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        # RGB Pose input, reused across same-size photos
+        img_rgb = self._rgb_scratch.get(small.shape)
+        if img_rgb is None:
+            if len(self._rgb_scratch) >= 4:
+                self._rgb_scratch.clear()
+            img_rgb = np.empty(small.shape, dtype=np.uint8)
+            self._rgb_scratch[small.shape] = img_rgb
+        cv2.cvtColor(small, cv2.COLOR_BGR2RGB, dst=img_rgb)
+        results = self.pose.process(img_rgb)
+
+        if not results.pose_landmarks:
             return None
 
+        # Normalized landmarks are scaled by the full-size image, not the downscaled one
+        landmarks = results.pose_landmarks.landmark
+        pts = np.fromiter(
+            (c for lm in landmarks for c in (lm.x, lm.y)), dtype=np.float64, count=2 * len(landmarks)
+        ).reshape(-1, 2)
+        pts *= (w, h)
+        return dict(enumerate(map(tuple, pts.astype(np.int64).tolist())))
+
+    def get_cached_keypoints(self, image_path, img):
+        # Pose runs once per product photo version; callers only read the keypoints
+        key = (image_path, os.stat(image_path).st_mtime_ns)
+        if key in self._keypoint_cache:
+            self._keypoint_cache.move_to_end(key)
+            return self._keypoint_cache[key]
+
+        keypoints = self._detect_on_bgr(img)
+        self._keypoint_cache[key] = keypoints
+        if len(self._keypoint_cache) > KEYPOINT_CACHE_SIZE:
+            self._keypoint_cache.popitem(last=False)
+        return keypoints
+
     # ---------------------------
     # Map location key to keypoint index
     # ---------------------------
     def get_logo_position(self, keypoints, location_key):
         try:
-            location_map = {
-                # (kept the same mapping you had — keys map to indexes)
-                "FULL-BACK": 1,
-                "FULL-FRONT": 2,
-                "LEFT-BICEP": 3,
-                "RIGHT-BICEP": 4,
-                "LEFT-CHEST": 5,
-                "RIGHT-CHEST": 6,
-                "LEFT-COLLAR": 7,
-                "RIGHT-COLLAR": 8,
-                "LEFT-CUFF": 9,
-                "RIGHT-CUFF": 10,
-                "LEFT-HIP": 11,
-                "RIGHT-HIP": 12,
-                "LEFT-SLEEVE": 13,
-                "RIGHT-SLEEVE": 14,
-                "LEFT-THIGH-HIGH": 15,
-                "RIGHT THIGH-HIGH": 16,
-                "ON-POCKET": 17,
-
-                "BACK-YOKE": 18,
-                "FULL-BACK & FULL-FRONT": 19,
-                "LEFT-BICEP-RIGHT-BICEP": 20,
-                "LEFT-CHEST-LEFT-BICEP-RIGHT-BICEP": 21,
-                "LEFT-CHEST-RIGHT-BICEP": 22,
-                "LEFT-CHEST-RIGHT-SLEEVE": 23,
-                "LEFT-SLEEVE-RIGHT-SLEEVE": 24,
-                "RIGHT-CHEST-LEFT-BICEP": 25,
-                "RIGHT-CHEST-LEFT-SLEEVE": 26,
-                "RIGHT-CHEST-LFT-BICEP-RIGHT-BICEP": 27,
-                "FULL-FRONT-FULL-BACK": 28,
-                "LEFT-CHEST-FULL-BACK": 29,
-                "RIGHT-CHEST-FULL-BACK": 30,
-
-                "FRONT-CROWN": 31,
-                "CAP-BACK": 32,
-                "CAP-SIDE": 33,
-                "CAP-FRONT-SIDE": 34,
-                "LOWER-LEFT-CROWN": 35,
-                "LOWER-RIGHT-CROWN": 36,
-                "Corner-Angled-Towel": 37,
-                "FRONT_CENTER": 38,
-                "FRONT (ON BAG)": 39,
-                "ON POCKET (ON BAG)": 40
-            }
-
             if location_key is None:
-                print("[DEBUG] location_key is None")
+                logger.debug("location_key is None")
                 return None
 
-            print(f"[DEBUG] Requested Location Key: {location_key}")
-            print(f"[DEBUG] Available Keypoints: {list(keypoints.keys())}")
-            landmark_index = location_map.get(location_key.upper())
-            print("landmark_index-------------", landmark_index)
+            landmark_index = LOCATION_MAP.get(location_key.upper())
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Requested Location Key: %s", location_key)
+                logger.debug("Available Keypoints: %s", list(keypoints.keys()))
+                logger.debug("landmark_index: %s", landmark_index)
             if landmark_index is None or landmark_index not in keypoints:
                 return None
             return keypoints[landmark_index]
         except Exception as e:
-            print(f"[Mapping Error] {e}")
-            traceback.print_exc()
+            logger.exception("[Mapping Error] %s", e)
             return None
 
     # ---------------------------
@@ -115,38 +358,54 @@ class LogoPositioner:
             if logo_img is None:
                 return None
             h, w = logo_img.shape[:2]
-            if w == 0:
+            if w == 0 or w == int(target_width):
                 return logo_img
             scale_ratio = target_width / float(w)
             dim = (int(target_width), max(1, int(h * scale_ratio)))
             return cv2.resize(logo_img, dim, interpolation=cv2.INTER_AREA)
         except Exception as e:
-            print(f"Error resizing logo: {e}")
-            traceback.print_exc()
+            logger.exception("Error resizing logo: %s", e)
             return logo_img
 
+    def get_resized_logo(self, logo_img, target_width):
+        # Keyed by the cached logo array from get_logo_image. The entry holds the source
+        # array itself, so a reused id() after an eviction can't match.
+        key = (id(logo_img), target_width)
+        cached = self._resized_logo_cache.get(key)
+        if cached is not None and cached[0] is logo_img:
+            self._resized_logo_cache.move_to_end(key)
+            return cached[1]
+
+        resized = self.resize_logo(logo_img, target_width)
+        self._resized_logo_cache[key] = (logo_img, resized)
+        if len(self._resized_logo_cache) > LOGO_CACHE_SIZE:
+            self._resized_logo_cache.popitem(last=False)
+        return resized
+
     # ---------------------------
     # Basic background remove (simple threshold method)
     # ---------------------------
     def remove_background(self, image):
+        # Blacks out near-white pixels in place and returns the same array
         try:
             if image is None:
                 return image
+            # No near-white corner: the photo has no white background to strip
+            corners = image[[0, 0, -1, -1], [0, -1, 0, -1]].reshape(4, 1, 3)
+            if not (cv2.cvtColor(corners, cv2.COLOR_BGR2GRAY) > 240).any():
+                return image
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            _, mask = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY)
-            # invert mask to keep non-white areas
-            mask_inv = cv2.bitwise_not(mask)
-            result = cv2.bitwise_and(image, image, mask=mask_inv)
-            return result
+            np.copyto(image, 0, where=(gray > 240)[..., np.newaxis])
+            return image
         except Exception as e:
-            print(f"Background removal failed: {e}")
-            traceback.print_exc()
+            logger.exception("Background removal failed: %s", e)
             return image
 
     # ---------------------------
     # Merge logo onto base image with alpha support (if present)
     # ---------------------------
     def merge_logo_on_image(self, base_image, logo_img, position):
+        # Draws into base_image itself and returns it
         try:
             if base_image is None or logo_img is None or position is None:
                 return base_image
@@ -156,12 +415,15 @@ class LogoPositioner:
             # logo_img may be BGRA or BGR
             if logo_img.ndim == 3 and logo_img.shape[2] == 4:
                 logo_bgr = logo_img[:, :, :3]
-                alpha = logo_img[:, :, 3] / 255.0
+                alpha = logo_img[:, :, 3]
+                # Hard-edged alpha (only 0 or 255) takes the masked copy below
+                binary_alpha = cv2.countNonZero(cv2.inRange(alpha, 1, 254)) == 0
             else:
                 logo_bgr = logo_img
                 # create alpha mask where non-white is opaque
-                white_mask = np.all(logo_bgr >= 250, axis=2)
-                alpha = (~white_mask).astype(float)
+                white_mask = cv2.inRange(logo_bgr, (250, 250, 250), (255, 255, 255))
+                alpha = cv2.bitwise_not(white_mask)
+                binary_alpha = True
 
             lh, lw = logo_bgr.shape[:2]
             bh, bw = base_image.shape[:2]
@@ -189,77 +451,209 @@ class LogoPositioner:
 
             # region of interest
             roi = base_image[ly:ly + logo_bgr.shape[0], lx:lx + logo_bgr.shape[1]]
+            if not roi.size:
+                # Landmark outside the image: nothing of the logo lands on it
+                return base_image
 
-            # alpha blending
-            alpha = alpha[..., np.newaxis]
-            blended = (alpha * logo_bgr.astype(float) + (1 - alpha) * roi.astype(float)).astype(np.uint8)
+            if binary_alpha:
+                # With alpha only 0 or 255 the blend is exactly a masked copy
+                cv2.copyTo(logo_bgr, alpha, roi)
+                return base_image
 
-            base_image[ly:ly + blended.shape[0], lx:lx + blended.shape[1]] = blended
+            # alpha blending in 16-bit fixed point, alpha kept as 0..255:
+            #   (a * logo + (255 - a) * roi + 127) // 255
+            # The sum peaks at 255 * 255 + 127, so uint16 never overflows.
+            # Done BLEND_TILE_ROWS rows at a time.
+            h, w = logo_bgr.shape[:2]
+            tile = min(h, BLEND_TILE_ROWS)
+            a_buf = self._blend_buffer("alpha", (tile, w, 1))
+            logo_buf = self._blend_buffer("logo", (tile, w, 3))
+            back_buf = self._blend_buffer("back", (tile, w, 3))
+            for y0 in range(0, h, tile):
+                y1 = min(y0 + tile, h)
+                a = a_buf[:y1 - y0]
+                blended = logo_buf[:y1 - y0]
+                back = back_buf[:y1 - y0]
+                np.copyto(a, alpha[y0:y1, :, np.newaxis])
+                np.copyto(blended, logo_bgr[y0:y1])
+                blended *= a
+                np.subtract(255, a, out=a)
+                np.copyto(back, roi[y0:y1])
+                back *= a
+                blended += back
+                blended += 127
+                blended //= 255
+
+                # roi is a view into base_image, so this writes the result in place
+                np.copyto(roi[y0:y1], blended, casting="unsafe")
             return base_image
 
         except Exception as e:
-            print(f"Error merging logo: {e}")
-            traceback.print_exc()
+            logger.exception("Error merging logo: %s", e)
             return base_image
 
+    def _blend_buffer(self, name, shape):
+        # uint16 working arrays for merge_logo_on_image; only ever grown
+        size = int(np.prod(shape))
+        buf = self._blend_scratch.get(name)
+        if buf is None or buf.size < size:
+            buf = np.empty(size, dtype=np.uint16)
+            self._blend_scratch[name] = buf
+        return buf[:size].reshape(shape)
+
     # ---------------------------
     # Main entry - place logo
     # ---------------------------
-    def place_logo_on_image(self, job_row, settings, image_root, logo_folder):
+    def place_logo_on_image(self, job_row, settings, image_root, logo_folder, async_write=False):
         """
         settings is expected to be a dict containing:
           - default_logo_width (int)
           - output_folder (str)
           - poppler_path (optional, str)  # used when converting PDFs on Windows
+        With async_write=True the output is encoded/written on a background thread
+        and is only guaranteed to be on disk after flush_writes().
         """
         try:
             client_folder = os.path.join(image_root, job_row["Supplier Name"])
             image_name = f"{job_row['Supplier Part ID']} {job_row.get('Supplier Color', '')}".strip()
             product_img_path = self.find_image_file(client_folder, image_name)
-            print("client_folder>>>>>>>>>>>>>", client_folder)
-            print("image_name>>>>>>>>>>>", image_name)
+            logger.debug("client_folder: %s", client_folder)
+            logger.debug("image_name: %s", image_name)
             if not product_img_path:
                 raise Exception(f"Image not found for {job_row['Supplier Part ID']} in {client_folder}")
 
-            logo_img_path = self.find_logo_file(job_row, logo_folder)
-            location_key = str(job_row.get("Location As per Word file", "")).strip()
+            location_key = job_row.get("Location As per Word file", "")
+            # Fail before the logo load and pose pass when no landmark can match
+            landmark_index = LOCATION_MAP.get(location_key.upper())
+            if landmark_index is None or landmark_index >= NUM_POSE_LANDMARKS:
+                raise Exception("Position not found")
+
+            # Read the product photo in the background while the logo loads
+            prefetch_file(product_img_path)
+            logo_img = self.get_logo_image(job_row, settings, logo_folder)
+
+            # Decode once; detection and compositing share the same array
+            base_img = read_image(product_img_path)
+            if base_img is None:
+                raise Exception("Failed to load base image: " + str(product_img_path))
 
-            keypoints = self.detect_human_keypoints(product_img_path)
+            try:
+                keypoints = self.get_cached_keypoints(product_img_path, base_img)
+            except Exception as e:
+                logger.error("[Keypoint Error] %s", e)
+                keypoints = None
             if not keypoints:
                 raise Exception("No keypoints found")
 
-            print("keypointskeypointskeypoints>>>>>>>>>>>>>>>>>>>>>", keypoints)
-            print("location_key>>>>>>>>>>>>>>>>>", location_key)
+            logger.debug("keypoints detected: %d", len(keypoints))
+            logger.debug("location_key: %s", location_key)
             position = self.get_logo_position(keypoints, location_key)
             if not position:
                 raise Exception("Position not found")
 
-            base_img = cv2.imread(product_img_path)
-            if base_img is None:
-                raise Exception("Failed to load base image: " + str(product_img_path))
-
-            base_img = self.remove_background(base_img)
+            if settings.get("remove_background", True):
+                base_img = self.remove_background(base_img)
 
-            # Load logo (pass poppler_path if provided in settings)
-            poppler_path = settings.get("poppler_path") if isinstance(settings, dict) else None
-            logo_img = self.load_logo_image(logo_img_path, poppler_path=poppler_path)
-            print("logo_imglogo_img>>>>>>>>>>>>>>>>>>>>>>>>>>>>", logo_img_path)
-            if logo_img is None:
-                raise Exception("Failed to load logo image: " + str(logo_img_path))
-
-            resized_logo = self.resize_logo(logo_img, settings["default_logo_width"])
+            resized_logo = self.get_resized_logo(logo_img, settings["default_logo_width"])
             merged_img = self.merge_logo_on_image(base_img, resized_logo, position)
 
             output_path = os.path.join(settings["output_folder"], job_row["Final Image Name"])
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            cv2.imwrite(output_path, merged_img)
+            ensure_dir(os.path.dirname(output_path))
+            ext = os.path.splitext(output_path)[1].lower()
+            write_params = INTERMEDIATE_WRITE_PARAMS.get(ext, [])
+            if async_write:
+                self._queue_write(output_path, merged_img, write_params)
+            else:
+                cv2.imwrite(output_path, merged_img, write_params)
 
             return output_path
         except Exception as e:
-            print(f"Error placing logo: {e}")
-            traceback.print_exc()
+            logger.exception("Error placing logo: %s", e)
             raise
 
+    def _queue_write(self, output_path, img, write_params):
+        # imwrite releases the GIL, so the next placement runs alongside it.
+        # Nothing outlives the next flush_writes().
+        result = {}
+
+        def write():
+            try:
+                result["ok"] = cv2.imwrite(output_path, img, write_params)
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=write, name="logo-output-writer")
+        thread.start()
+        self._pending_writes.append((output_path, thread, result))
+
+    def flush_writes(self):
+        """
+        Waits for every async_write output. Returns [(output path, error)]
+        for the ones that could not be written.
+        """
+        failures = []
+        pending, self._pending_writes = self._pending_writes, []
+        for output_path, thread, result in pending:
+            thread.join()
+            error = result.get("error")
+            if error is None and not result.get("ok"):
+                error = IOError(f"Failed to write image: {output_path}")
+            if error is not None:
+                failures.append((output_path, error))
+        return failures
+
+    # ---------------------------
+    # Load logo once per decoration code
+    # ---------------------------
+    def get_logo_image(self, job_row, settings, logo_folder):
+        # Cached per decoration code; a hit costs one stat so an edited logo is reloaded
+        cache_key = (logo_folder, job_row.get("Decoration Code"))
+        cached = self._logo_cache.get(cache_key)
+        if cached is not None:
+            cached_path, cached_mtime, logo_img = cached
+            try:
+                if os.stat(cached_path).st_mtime_ns == cached_mtime:
+                    self._logo_cache.move_to_end(cache_key)
+                    return logo_img
+            except OSError:
+                pass
+            del self._logo_cache[cache_key]
+
+        logo_img_path = self.find_logo_file(job_row, logo_folder)
+        logo_mtime = os.stat(logo_img_path).st_mtime_ns
+
+        # Load logo (pass poppler_path if provided in settings)
+        poppler_path = settings.get("poppler_path") if isinstance(settings, dict) else None
+        target_width = settings.get("default_logo_width") if isinstance(settings, dict) else None
+
+        # PDF renders are reused from earlier runs via logo_cache_folder
+        cache_folder = settings.get("logo_cache_folder") if isinstance(settings, dict) else None
+        cache_path = None
+        logo_img = None
+        if cache_folder and logo_img_path.lower().endswith(".pdf"):
+            try:
+                cache_path = pdf_logo_cache_path(logo_img_path, target_width, cache_folder)
+                logo_img = read_image(cache_path, cv2.IMREAD_UNCHANGED)
+            except OSError as e:
+                logger.warning("PDF logo cache unavailable: %s", e)
+                cache_path = None
+
+        if logo_img is None:
+            logo_img = self.load_logo_image(logo_img_path, poppler_path=poppler_path, target_width=target_width)
+            if logo_img is not None and cache_path:
+                try:
+                    store_pdf_logo_cache(cache_path, logo_img)
+                except OSError as e:
+                    logger.warning("Could not write PDF logo cache %s: %s", cache_path, e)
+        logger.debug("logo_img_path: %s", logo_img_path)
+        if logo_img is None:
+            raise Exception("Failed to load logo image: " + str(logo_img_path))
+
+        self._logo_cache[cache_key] = (logo_img_path, logo_mtime, logo_img)
+        if len(self._logo_cache) > LOGO_CACHE_SIZE:
+            self._logo_cache.popitem(last=False)
+        return logo_img
+
     # ---------------------------
     # Find logo file (png/jpg/pdf)
     # ---------------------------
@@ -267,58 +661,147 @@ class LogoPositioner:
         base_name = job_row.get("Decoration Code")
         if not base_name:
             raise FileNotFoundError("Decoration Code missing in job_row")
-        expected_names = [
-            f"{base_name}.png",
-            f"{base_name}.jpg",
-            f"{base_name}.jpeg",
-            f"{base_name}.pdf"
-        ]
-        for name in expected_names:
-            full_path = os.path.join(logo_folder, name)
-            if os.path.exists(full_path):
-                return full_path
+        if "/" in base_name or os.sep in base_name:
+            # Code points into a subfolder: not in the flat listing, check the disk
+            for ext in LOGO_EXTENSIONS:
+                full_path = os.path.join(logo_folder, base_name + ext)
+                if os.path.exists(full_path):
+                    return full_path
+        else:
+            logo_files = self.index_logo_folder(logo_folder)
+            for ext in LOGO_EXTENSIONS:
+                full_path = logo_files.get(os.path.normcase(base_name + ext))
+                if full_path is not None:
+                    return full_path
         raise FileNotFoundError(f"Logo file not found for {base_name} in {logo_folder}")
 
+    def index_logo_folder(self, logo_folder):
+        # One scandir per logo folder, rebuilt when its mtime changes. Names go through
+        # normcase so lookups are case-insensitive on Windows.
+        mtime = _dir_mtime(logo_folder)
+        cached = self._logo_index.get(logo_folder)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        logo_files = {}
+        try:
+            with os.scandir(logo_folder) as it:
+                for entry in it:
+                    if entry.is_file():
+                        logo_files[os.path.normcase(entry.name)] = entry.path
+        except OSError:
+            pass  # missing folder: every lookup misses
+        self._logo_index[logo_folder] = (mtime, logo_files)
+        return logo_files
+
     # ---------------------------
     # Find product image by searching filenames
     # ---------------------------
     def find_image_file(self, client_dir, supplier_part_id):
-        if not os.path.isdir(client_dir):
+        files, by_stem, names_blob, name_starts = self.index_image_folder(client_dir)
+        needle = str(supplier_part_id)
+        # Most product photos are named exactly "<part id> <color>.<ext>": one dict lookup
+        full_path = by_stem.get(needle)
+        if full_path is not None:
+            return full_path
+        if not needle or "\n" in needle:
+            # Can't be searched in the newline-joined blob; scan name by name
+            for file, full_path in files:
+                if needle in file:
+                    return full_path
             return None
-        for root, _, files in os.walk(client_dir):
-            for file in files:
-                if str(supplier_part_id) in file and file.lower().endswith((".jpg", ".jpeg", ".png")):
-                    return os.path.join(root, file)
-        return None
+        # The lowest match offset lies inside the first file (in walk order) that contains it
+        pos = names_blob.find(needle)
+        if pos < 0:
+            return None
+        return files[bisect.bisect_right(name_starts, pos) - 1][1]
+
+    def index_image_folder(self, client_dir):
+        # Returns ([(file name, full path)], {file stem: first full path with that stem},
+        #          all file names joined by "\n", offset of each name in that string)
+        # Cached per client folder; rebuilt when any walked folder's mtime changes.
+        cached = self._image_index.get(client_dir)
+        if cached is not None:
+            dir_mtimes, index = cached
+            if all(_dir_mtime(d) == m for d, m in dir_mtimes):
+                return index
+
+        files = []
+        by_stem = {}
+        dir_mtimes = []
+        _walk_product_images(client_dir, files, by_stem, dir_mtimes)
+
+        names_blob = "\n".join(file for file, _ in files)
+        name_starts = []
+        offset = 0
+        for file, _ in files:
+            name_starts.append(offset)
+            offset += len(file) + 1
+        index = (files, by_stem, names_blob, name_starts)
+        self._image_index[client_dir] = (dir_mtimes, index)
+        return index
 
     # ---------------------------
     # Helper: convert PIL -> cv2 and load files (PIL + pdf2image)
     # ---------------------------
     @staticmethod
     def pil_to_cv2(pil_img):
-        arr = np.array(pil_img)
+        arr = np.asarray(pil_img)
         if arr.ndim == 2:  # grayscale
             return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
         if arr.shape[2] == 4:  # RGBA -> BGRA
             return cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA)
         # RGB -> BGR
         return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-    def load_logo_image(self, logo_path, poppler_path=None):
+
+    @staticmethod
+    def pdf_page_to_cv2(page):
+        # Opaque BGRA, the alpha channel filled in by cvtColor
+        if page.mode != "RGB":
+            page = page.convert("RGB")
+        return cv2.cvtColor(np.asarray(page), cv2.COLOR_RGB2BGRA)
+
+    @staticmethod
+    def render_pdf_with_pymupdf(logo_path, target_width=None):
+        # Returns the first page as BGRA (same as the poppler path), or None when
+        # PyMuPDF isn't installed or can't render the file
+        try:
+            import fitz
+        except ImportError:
+            return None
+        try:
+            with fitz.open(logo_path) as doc:
+                page = doc[0]
+                if target_width:
+                    zoom = target_width * PDF_RENDER_OVERSAMPLE / page.rect.width
+                else:
+                    zoom = 300 / 72.0
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                rgb = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, pix.n)
+                logger.debug("PDF converted using PyMuPDF")
+                return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGRA)
+        except Exception as e:
+            logger.warning("PyMuPDF render failed, falling back to poppler: %s", e)
+            return None
+
+    def load_logo_image(self, logo_path, poppler_path=None, target_width=None):
         """
         Returns an OpenCV image (BGR or BGRA) or None on failure.
-        For PDFs: tries convert_from_path with explicit poppler_path fallback checks.
+        For PDFs: renders with PyMuPDF when installed, otherwise tries convert_from_path
+        with explicit poppler_path fallback checks; either way at
+        PDF_RENDER_OVERSAMPLE x target_width when it is given.
         """
         try:
-            print("logo_path----------------------------------------", logo_path)
+            logger.debug("logo_path: %s", logo_path)
             if not logo_path:
-                print("Empty logo_path provided")
+                logger.error("Empty logo_path provided")
                 return None
             if not os.path.exists(logo_path):
-                print(f"File not found: {logo_path}")
+                logger.error("File not found: %s", logo_path)
                 return None
 
             ext = os.path.splitext(logo_path)[1].lower()
-            print("Logo extension:", ext)
+            logger.debug("Logo extension: %s", ext)
 
             # Helper: check if a candidate bin path contains pdftoppm/pdfinfo
             def has_poppler_bin(candidate):
@@ -338,6 +821,20 @@ class LogoPositioner:
 
             # PDF handling
             if ext == ".pdf":
+                # In-process render first: no pdftoppm subprocess, no image file round trip
+                logo_img = self.render_pdf_with_pymupdf(logo_path, target_width)
+                if logo_img is not None:
+                    return logo_img
+
+                # Imported on first PDF only: image-only logo folders never load pdf2image
+                from pdf2image import convert_from_path
+
+                # Only pages[0] is used, so pdftoppm is told to stop after page 1
+                render_kwargs = {"dpi": 300, "fmt": PDF_RENDER_FORMAT, "first_page": 1, "last_page": 1}
+                if target_width:
+                    # pdftoppm -scale-to-x: pixel count follows the placement size, not the page size
+                    render_kwargs["size"] = (int(target_width * PDF_RENDER_OVERSAMPLE), None)
+
                 # build list of poppler candidates to try
                 candidates = []
                 if poppler_path:
@@ -363,35 +860,33 @@ class LogoPositioner:
                 for cand in candidates:
                     if not cand:
                         continue
-                    print(f"Trying poppler_path candidate: {cand}")
+                    logger.debug("Trying poppler_path candidate: %s", cand)
                     try:
-                        pages = convert_from_path(logo_path, poppler_path=cand, dpi=300, fmt="jpeg")
+                        pages = convert_from_path(logo_path, poppler_path=cand, **render_kwargs)
                         if pages:
-                            pil_img = pages[0].convert("RGBA")
-                            logo_img = self.pil_to_cv2(pil_img)
-                            print("PDF converted using poppler_path:", cand)
+                            logo_img = self.pdf_page_to_cv2(pages[0])
+                            logger.debug("PDF converted using poppler_path: %s", cand)
                             return logo_img
                     except Exception as e:
                         last_exc = e
-                        print(f"convert_from_path failed with candidate {cand}: {e}")
+                        logger.debug("convert_from_path failed with candidate %s: %s", cand, e)
 
                 # If convert_from_path without explicit poppler_path sometimes works (rare), try it once more
                 try:
-                    print("Attempting convert_from_path without explicit poppler_path (last resort)...")
-                    pages = convert_from_path(logo_path, dpi=300, fmt="jpeg")
+                    logger.debug("Attempting convert_from_path without explicit poppler_path (last resort)...")
+                    pages = convert_from_path(logo_path, **render_kwargs)
                     if pages:
-                        pil_img = pages[0].convert("RGBA")
-                        logo_img = self.pil_to_cv2(pil_img)
-                        print("PDF converted without explicit poppler_path")
+                        logo_img = self.pdf_page_to_cv2(pages[0])
+                        logger.debug("PDF converted without explicit poppler_path")
                         return logo_img
                 except Exception as e:
                     last_exc = e
-                    print("convert_from_path without explicit poppler_path failed:", e)
+                    logger.debug("convert_from_path without explicit poppler_path failed: %s", e)
 
                 # nothing worked
-                print("PDF -> image conversion failed. Tried candidates:", candidates)
+                logger.error("PDF -> image conversion failed. Tried candidates: %s", candidates)
                 if last_exc:
-                    print("Last exception:", last_exc)
+                    logger.error("Last exception: %s", last_exc)
                 return None
 
             # Non-PDF: use PIL for better color profile handling
@@ -407,25 +902,23 @@ class LogoPositioner:
 
                 logo_img = self.pil_to_cv2(pil_img)
                 if logo_img is None:
-                    print("PIL loaded image but conversion returned None")
+                    logger.error("PIL loaded image but conversion returned None")
                 return logo_img
 
             except Exception as e:
                 # Fallback to cv2.imread
-                print("PIL open failed, falling back to cv2.imread:", e)
+                logger.debug("PIL open failed, falling back to cv2.imread: %s", e)
                 try:
-                    logo_img = cv2.imread(logo_path, cv2.IMREAD_UNCHANGED)
+                    logo_img = read_image(logo_path, cv2.IMREAD_UNCHANGED)
                     if logo_img is None:
-                        print(f"cv2.imread failed to read: {logo_path}")
+                        logger.error("cv2.imread failed to read: %s", logo_path)
                     return logo_img
                 except Exception as e2:
-                    print("cv2.imread also failed:", e2)
-                    traceback.print_exc()
+                    logger.exception("cv2.imread also failed: %s", e2)
                     return None
 
         except Exception as e:
-            print(f"Error loading logo image: {e}")
-            traceback.print_exc()
+            logger.exception("Error loading logo image: %s", e)
             return None
 
     # def load_logo_image(self, logo_path, poppler_path=None):
@@ -1,64 +1,202 @@
 import os
 import json
+import logging
+import multiprocessing
 import traceback
-from src.excel_parser import parse_excel_file
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from src.excel_parser import iter_excel_rows
 from src.logo_positioner import LogoPositioner
-from src.exporter import export_final_image
-from src.utils import setup_logging, log_error, create_output_dirs, is_back_location
+from src.exporter import PhotoshopSession
+from src.utils import (
+    setup_logging, create_output_dirs, is_back_location,
+    start_log_listener, stop_log_listener, install_queue_logging, clear_ensured_dirs
+)
+
+logger = logging.getLogger(__name__)
+
+# One positioner per worker process (MediaPipe graphs can't be shared or pickled)
+_positioner = None
+# Run this worker last placed a row for; see _place_job
+_run_id = None
+
+# Worker pool kept across runs (e.g. repeated GUI clicks), so MediaPipe is only
+# loaded once per worker. Workers log to _log_queue; each run listens on it.
+_executor = None
+_executor_key = None
+_log_queue = None
+
+def _init_worker(template_folder, log_queue):
+    global _positioner
+    # Drop handlers inherited on fork; all records go back to the parent's listener
+    logging.getLogger().handlers.clear()
+    install_queue_logging(log_queue, lambda: _run_id)
+
+    # Each worker already owns a core; keep OpenCV/OpenMP from spawning their own pools
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    cv2.setNumThreads(1)
+    _positioner = LogoPositioner(template_folder)
+
+def _place_job(idx, job, settings, image_folder, logo_folder, run_id):
+    # Runs in a worker process; returns the intermediate image path
+    global _run_id
+    if run_id != _run_id:
+        # Workers outlive a run and output folders may have been deleted since
+        clear_ensured_dirs()
+        _run_id = run_id
+
+    if not job.get("Supplier Name"):
+        raise ValueError(f"Missing Supplier Name for row {idx + 1}")
+
+    logger.debug("Processing Job: %s", job["Final Image Name"])
+
+    # For a FULL-BACK row the main image is written while its FRONT_ image is placed
+    with_front = is_back_location(job["Location As per Word file"])
+    try:
+        # Place main logo
+        intermediate_image_path = _positioner.place_logo_on_image(
+            job, settings, image_folder, logo_folder, async_write=with_front
+        )
+
+        # Also create front image if location is "FULL-BACK"
+        if with_front:
+            front_job = job.copy()
+            front_job["Location As per Word file"] = "FULL-FRONT"
+            front_job["Final Image Name"] = "FRONT_" + job["Final Image Name"]
+            try:
+                _positioner.place_logo_on_image(front_job, settings, image_folder, logo_folder)
+            except Exception as fe:
+                logger.error("Front image placement failed for %s: %s", front_job["Final Image Name"], fe)
+    finally:
+        # The returned path goes straight to export, so everything must be on disk first
+        write_failures = _positioner.flush_writes()
+
+    for _, error in write_failures:
+        raise error
+
+    return intermediate_image_path
+
+def get_executor(settings):
+    global _executor, _executor_key, _log_queue
+    max_workers = settings.get("max_workers") or os.cpu_count()
+    key = (max_workers, settings["template_folder"])
+    if _executor is not None and _executor_key != key:
+        # Settings changed between runs
+        shutdown_executor()
+    if _executor is None:
+        if _log_queue is None:
+            _log_queue = multiprocessing.Queue(-1)
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(settings["template_folder"], _log_queue)
+        )
+        _executor_key = key
+    return _executor, _log_queue
+
+def shutdown_executor():
+    global _executor, _executor_key
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+        _executor_key = None
+
+def _flush_exports(photoshop, pending_exports, settings):
+    # Runs one Photoshop script for every placed image queued so far
+    try:
+        failures = photoshop.export(pending_exports, settings)
+    except Exception as e:
+        failures = [(job, e) for _, job in pending_exports]
+        traceback.print_exc()
+    for job, e in failures:
+        logger.error("Failed Job: %s | Error: %s", job.get("Final Image Name", "Unknown"), e)
+    pending_exports.clear()
 
-def process_all_images(excel_file, image_folder, logo_folder, progress_callback=None):
+def process_all_images(excel_file, image_folder, logo_folder, progress_callback=None, cancel_event=None):
     # Step 1: Setup
     log_path = setup_logging()
-    create_output_dirs()
     print(f"Logging to: {log_path}")
 
     # Step 2: Load config
     with open("config/settings.json", "r") as f:
         settings = json.load(f)
+    create_output_dirs(settings["output_folder"], settings["thumbnail_folder"])
 
-    try:
-        job_data = parse_excel_file(excel_file)
-        total = len(job_data)
-        positioner = LogoPositioner(settings["template_folder"])
+    executor, log_queue = get_executor(settings)
 
-        for idx, job in enumerate(job_data):
-            try:
-                if not job.get("Supplier Name"):
-                    raise ValueError(f"Missing Supplier Name for row {idx + 1}")
-
-                print(f"Processing Job: {job['Final Image Name']}")
-
-                # Place main logo
-                intermediate_image_path = positioner.place_logo_on_image(
-                    job, settings, image_folder, logo_folder
-                )
-
-                # Also create front image if location is "FULL-BACK"
-                if is_back_location(job["Location As per Word file"]):
-                    front_job = job.copy()
-                    front_job["Location As per Word file"] = "FULL-FRONT"
-                    front_job["Final Image Name"] = "FRONT_" + job["Final Image Name"]
-                    try:
-                        positioner.place_logo_on_image(front_job, settings, image_folder, logo_folder)
-                    except Exception as fe:
-                        log_error(
-                            f"Front image placement failed for {front_job['Final Image Name']}: {fe}", log_path
-                        )
-
-                # Export final image using Photoshop JSX
-                export_final_image(intermediate_image_path, job, settings)
-
-            except Exception as e:
-                error_msg = f"Failed Job: {job.get('Final Image Name', 'Unknown')} | Error: {str(e)}"
-                log_error(error_msg, log_path)
-                traceback.print_exc()
-
-            if progress_callback:
-                progress_callback((idx + 1) * 100 // total)
+    # Log records and cached folders are tied to this run, here and in each worker
+    run_id = uuid.uuid4().hex
+    clear_ensured_dirs()
 
+    # Only the listener thread in this process writes the log file
+    log_listener = start_log_listener(log_path, log_queue, run_id)
+    queue_handler = install_queue_logging(log_queue, lambda: run_id)
+
+    try:
+        export_batch_size = settings.get("export_batch_size") or 1
+        pending_exports = []
+
+        # One Photoshop connection serves every export batch of this run
+        with PhotoshopSession() as photoshop:
+            # Step 3: Rows are independent, so logo placement runs in parallel.
+            # Rows are submitted while the sheet is still streaming in
+            futures = {
+                executor.submit(_place_job, idx, job, settings, image_folder, logo_folder, run_id): job
+                for idx, job in enumerate(iter_excel_rows(excel_file))
+            }
+            total = len(futures)
+
+            # Step 4: Export placed images in batches; Photoshop only runs one script at a time
+            done = 0
+            for future in as_completed(futures):
+                if cancel_event is not None and cancel_event.is_set():
+                    # Drop queued rows; rows already running in a worker finish in the background
+                    for pending in futures:
+                        pending.cancel()
+                    logger.info("Processing cancelled")
+                    break
+
+                job = futures[future]
+                try:
+                    pending_exports.append((future.result(), job))
+                except BrokenProcessPool as e:
+                    # A worker died and took the pool down; the next run builds a new one
+                    logger.error("Failed Job: %s | Error: %s", job.get("Final Image Name", "Unknown"), e)
+                    shutdown_executor()
+                    done += 1
+                except Exception as e:
+                    logger.error("Failed Job: %s | Error: %s", job.get("Final Image Name", "Unknown"), e)
+                    traceback.print_exc()
+                    done += 1
+
+                if len(pending_exports) >= export_batch_size:
+                    done += len(pending_exports)
+                    _flush_exports(photoshop, pending_exports, settings)
+
+                if progress_callback:
+                    progress_callback(done * 100 // total)
+
+            # Images already placed are still exported, even after a cancel
+            if pending_exports:
+                done += len(pending_exports)
+                _flush_exports(photoshop, pending_exports, settings)
+                if progress_callback:
+                    progress_callback(done * 100 // total)
+
+    except BrokenProcessPool as e:
+        # Raised by submit once the pool is down
+        logger.error("Failed to process Excel: %s", e)
+        shutdown_executor()
     except Exception as e:
-        log_error(f"Failed to process Excel: {str(e)}", log_path)
+        logger.error("Failed to process Excel: %s", e)
         traceback.print_exc()
+    finally:
+        logging.getLogger().removeHandler(queue_handler)
+        stop_log_listener(log_listener)
 
 if __name__ == "__main__":
     # For command line testing
@@ -66,6 +204,7 @@ if __name__ == "__main__":
     image_folder = "input/assets/"
     logo_folder = "input/assets/logos/"
     process_all_images(excel, image_folder, logo_folder)
+    shutdown_executor()
 
 
 # # main.py
@@ -1,7 +1,11 @@
 # utils.py
 
 import os
+import re
 import datetime
+import logging
+import logging.handlers
+import threading
 
 def setup_logging(log_dir="./logs"):
     if not os.path.exists(log_dir):
@@ -9,22 +13,70 @@ def setup_logging(log_dir="./logs"):
     log_file = os.path.join(log_dir, f"log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
     return log_file
 
-def log_error(error_message, log_path="./logs/error_log.txt"):
-    os.makedirs(os.path.dirname(log_path), exist_ok=True)
-    with open(log_path, "a") as f:
-        f.write(f"[{datetime.datetime.now()}] {error_message}\n")
+def start_log_listener(log_path, log_queue, run_id):
+    # Worker processes put records on the queue; the listener thread is the only file writer.
+    # The queue outlives a run, so records tagged with another run (workers still
+    # finishing a cancelled one) are left out of this run's file.
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    handler.addFilter(lambda record: getattr(record, "run_id", run_id) == run_id)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+def stop_log_listener(listener):
+    # QueueListener.stop() leaves its handlers open; close the log file too
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+def install_queue_logging(log_queue, get_run_id):
+    # Records are tagged with get_run_id() (when known) for start_log_listener's filter
+    def tag_run_id(record):
+        run_id = get_run_id()
+        if run_id is not None:
+            record.run_id = run_id
+        return True
+
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(tag_run_id)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    return handler
+
+def ensure_dirs(paths):
+    # Deepest first: a nested folder's makedirs also creates its ancestors
+    created = []
+    for path in sorted({os.path.abspath(p) for p in paths}, key=lambda p: p.count(os.sep), reverse=True):
+        if any(c.startswith(path + os.sep) for c in created):
+            continue
+        os.makedirs(path, exist_ok=True)
+        created.append(path)
+
+# Folders this process has created during the current run (see clear_ensured_dirs)
+_ensured_dirs = set()
+_ensured_dirs_lock = threading.Lock()
+
+def clear_ensured_dirs():
+    with _ensured_dirs_lock:
+        _ensured_dirs.clear()
+
+def ensure_dir(path):
+    if path in _ensured_dirs:
+        return
+    with _ensured_dirs_lock:
+        if path not in _ensured_dirs:
+            os.makedirs(path, exist_ok=True)
+            _ensured_dirs.add(path)
 
 def create_output_dirs(base_output="./output/", thumbnail_output="./output/thumbnails/"):
-    os.makedirs(base_output, exist_ok=True)
-    os.makedirs(thumbnail_output, exist_ok=True)
+    ensure_dirs([base_output, thumbnail_output])
 
-def is_back_location(location):
-    back_keywords = ["BACK", "FULL-BACK"]
-    return any(keyword.lower() in location.lower() for keyword in back_keywords)
+BACK_LOCATION_RE = re.compile("|".join(map(re.escape, ["BACK", "FULL-BACK"])), re.IGNORECASE)
 
-def is_front_location(location):
-    front_keywords = ["FRONT", "FULL-FRONT"]
-    return any(keyword.lower() in location.lower() for keyword in front_keywords)
+def is_back_location(location):
+    return BACK_LOCATION_RE.search(location) is not None
 
 
 